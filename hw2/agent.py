@@ -3,10 +3,10 @@ import inspect
 import logging
 import multiprocessing as mp
 import os
-import time
 
 import gym
 import numpy as np
+import scipy.signal
 import tensorflow as tf
 
 import logz
@@ -45,9 +45,17 @@ class Agent(mp.Process):
             results=None,
             state=None,
             network_weights=None,
-            paths_queue=None,
+            path_summaries=None,
             num_agents=1,
-            async_transitions=False):  # TODO(wy): fix this constructor argument mess
+            async_transitions=False,
+            num_envs=1,
+            shared_weights=None,
+            weights_generation=None,
+            state_barrier=None,
+            agent_id=0,
+            pin_cpus=False,
+            use_fast_rollout=False
+    ):  # TODO(wy): fix this constructor argument mess
 
         mp.Process.__init__(self)
 
@@ -61,19 +69,32 @@ class Agent(mp.Process):
         self.nn_baseline = nn_baseline
         self.normalize_advantages = normalize_advantages
 
+        # Index of this agent's region in the shared results
+        self._agent_id = agent_id
+
         # Shared IPC Queues
-        self.results = results
+        self.results = results  # ipc.SharedResults
         self.state_queue = state
         self.network_weights = network_weights
-        self.paths_queue = paths_queue
+        self.path_summaries = path_summaries  # ipc.PathSummaries
+
+        # Shared memory holding the flat network weights published by the
+        # trainer, and a counter bumped on every publication
+        self.shared_weights = shared_weights
+        self.weights_generation = weights_generation
+        self._last_seen_generation = 0
+
+        # Barrier across all agents, used to hold back tasks that every agent
+        # must pick up exactly once per epoch
+        self.state_barrier = state_barrier
 
-        # TODO(wy): num_agents is passed in only for the benefit of being able
-        # to assert that the shared results queue is empty after looping through
-        # num_agents, during training state. Probably better to just remove this
-        # parameter and loop until results empty.
         self.num_agents = num_agents
-        self.env = None  # Gym environment
-        
+        self.num_envs = num_envs
+        self.envs = []  # Gym environments, stepped in lockstep
+
+        # Whether to pin this agent to a single core and run it single threaded
+        self.pin_cpus = pin_cpus
+
         # Whether FSM transitions are controlled by the outside (synchronous
         # agent updates)
         self.async_transitions = async_transitions
@@ -82,50 +103,129 @@ class Agent(mp.Process):
 
         self.EPOCHES_PER_SYNC: int = 5
 
-        tf.set_random_seed(seed)
-        np.random.seed(seed)
+        # Seeding happens in _setup, in the agent process itself
+        self.seed = seed
 
         self._model = None
 
+        # Rollout buffer layout, known once the environment is created
+        self._ob_dim = None
+        self._ac_shape = None
+        self._ac_dtype = None
+        self._env_actions = None
+
+        # Whether rollouts are compiled by fast_rollout instead of stepping gym
+        self.use_fast_rollout = use_fast_rollout
+        self._max_episode_steps = None
+
+        self._gamma_powers = None  # gamma ** t, set up with max_path_length
+
     def _simulate(self):
-        # Collect paths until we have enough timesteps
+        if self.use_fast_rollout:
+            return self._simulate_compiled()
+
+        # Collect paths until we have enough timesteps. All environments are
+        # stepped in lockstep so that each decision tick is a single batched
+        # policy evaluation instead of one per environment.
         timesteps_this_batch = 0
         paths = []
-        enough_timesteps = False
-        while not enough_timesteps:
-            ob = self.env.reset()
-            obs, acs, rewards = [], [], []
-            # animate_this_episode = (
-            #     len(paths) == 0 and (itr % 10 == 0) and animate)
-            steps = 0
-
-            done_trajectory = False
-            while not done_trajectory:
-                # if animate_this_episode:
-                #     env.render()
-                #     time.sleep(0.05)
-                obs.append(ob)
-                ac = self._model.run_agent(ob)
-                ac = ac[0]
-                acs.append(ac)
-                ob, rew, done, _ = self.env.step(ac)
-                rewards.append(rew)
-                steps += 1
-
-                done_trajectory = (done or steps > self.max_path_length)
-
-            path = {
-                "observation": np.array(obs),
-                "reward": np.array(rewards),
-                "action": np.array(acs)
-            }
-            paths.append(path)
-            timesteps_this_batch += len(path['reward'])
-
-            enough_timesteps = (timesteps_this_batch >
-                                self.min_timesteps_per_batch)
+        num_envs = len(self.envs)
+
+        # Trajectories end once steps exceeds max_path_length, so they can
+        # hold at most max_path_length + 1 steps
+        buffer_length = self.max_path_length + 1
+
+        # Per environment trajectory buffers, reused after each finished path
+        obs = np.empty(
+            (num_envs, buffer_length, self._ob_dim), dtype=np.float32)
+        acs = np.empty(
+            (num_envs, buffer_length) + self._ac_shape, dtype=self._ac_dtype)
+        rewards = np.empty((num_envs, buffer_length), dtype=np.float32)
+        steps = [0] * num_envs
+
+        # Bind everything used per step to locals to skip the attribute
+        # lookups in the loop below
+        run_agent = self._model.run_agent
+        max_path_length = self.max_path_length
+        min_timesteps_per_batch = self.min_timesteps_per_batch
+        env_actions = self._env_actions
+        env_fns = [(env.step, env.reset) for env in self.envs]
+
+        ob_batch = np.empty((num_envs, self._ob_dim), dtype=np.float32)
+        for i, (_, reset) in enumerate(env_fns):
+            ob_batch[i] = reset()
+
+        # Environments with a path in progress. Once the batch has enough
+        # timesteps, environments that finish a path are not reset anymore,
+        # but the paths still in progress are completed and kept. Dropping
+        # them would throw away collected steps and bias the batch towards
+        # short paths.
+        active = list(range(num_envs))
+        while active:
+            if len(active) == num_envs:
+                active_ob_batch = ob_batch
+            else:
+                active_ob_batch = ob_batch[active]
+            ac_batch = run_agent(active_ob_batch)
+
+            # Store the whole tick in the buffers at once
+            active_steps = [steps[i] for i in active]
+            obs[active, active_steps] = active_ob_batch
+            acs[active, active_steps] = ac_batch
+
+            still_active = []
+            for i, ac in zip(active, env_actions(ac_batch)):
+                env_step, reset = env_fns[i]
+                step = steps[i]
+                ob, rew, done, _ = env_step(ac)
+                rewards[i, step] = rew
+                step += 1
+
+                if done or step > max_path_length:
+                    # Copy out of the buffers since they are reused for the
+                    # next trajectory of this environment
+                    paths.append({
+                        "observation": obs[i, :step].copy(),
+                        "reward": rewards[i, :step].copy(),
+                        "action": acs[i, :step].copy()
+                    })
+                    timesteps_this_batch += step
+
+                    if timesteps_this_batch > min_timesteps_per_batch:
+                        continue
+
+                    ob = reset()
+                    step = 0
+
+                ob_batch[i] = ob
+                steps[i] = step
+                still_active.append(i)
+
+            active = still_active
+
         return paths, timesteps_this_batch
 
+    @staticmethod
+    def _discrete_env_actions(ac_batch):
+        # One conversion to Python ints per tick instead of handing every
+        # environment a numpy scalar
+        return ac_batch.tolist()
+
+    @staticmethod
+    def _continuous_env_actions(ac_batch):
+        # Rows of the batch, one action vector per environment
+        return ac_batch
+
+    def _simulate_compiled(self):
+        import fast_rollout
+
+        # Same paths as the gym loop in _simulate, which ends a path at the
+        # environment's time limit or once steps exceeds max_path_length
+        max_steps = min(self._max_episode_steps, self.max_path_length + 1)
+        return fast_rollout.rollout(self.env_name, self._model.dump_weights(),
+                                    self._model.policy_layer_sizes, max_steps,
+                                    self.min_timesteps_per_batch)
+
     def _rollout(self):
         total_timesteps = 0
 
@@ -134,11 +234,26 @@ class Agent(mp.Process):
         total_timesteps += timesteps_this_batch
 
         # Build arrays for observation, action for the policy gradient update by concatenating
-        # across paths
-        ob_no = np.concatenate([path["observation"] for path in paths])
-        ac_na = np.concatenate([path["action"] for path in paths])
+        # across paths. Copy each path straight into the final buffers rather
+        # than going through np.concatenate's intermediate list of arrays.
+        ob_no = np.empty(
+            (timesteps_this_batch, self._ob_dim), dtype=np.float32)
+        ac_na = np.empty(
+            (timesteps_this_batch, ) + self._ac_shape, dtype=self._ac_dtype)
+        offset = 0
+        for path in paths:
+            end = offset + len(path["reward"])
+            ob_no[offset:end] = path["observation"]
+            ac_na[offset:end] = path["action"]
+            offset = end
+
+        q_n = self._compute_q_values(self.gamma, paths, self.reward_to_go,
+                                     self._gamma_powers)
 
-        q_n = self._compute_q_values(self.gamma, paths, self.reward_to_go)
+        # q_n statistics are shared by the baseline rescaling and the baseline
+        # targets, so only reduce over q_n once
+        q_mean = q_n.mean()
+        q_std = q_n.std()
 
         #region nn_baseline and normalize_advantage
         #====================================================================================#
@@ -146,7 +261,9 @@ class Agent(mp.Process):
         # Computing Baselines
         #====================================================================================#
 
-        baseline_prediction = []
+        # Everything sent back for training is float32 to match the model
+        # placeholders, which also halves the bytes pickled through the queues
+        baseline_prediction = np.empty(0, dtype=np.float32)
         if self.nn_baseline:
             # If nn_baseline is True, use your neural network to predict
             # Q-value at each timestep for each trajectory, and save the
@@ -160,7 +277,7 @@ class Agent(mp.Process):
             baseline_prediction = self._model.predict_baseline(ob_no)
 
             # Scale to q_n statistics
-            b_n = np.mean(q_n) + baseline_prediction * np.std(q_n)
+            b_n = q_mean + baseline_prediction * q_std
             adv_n = q_n - b_n
         else:
             adv_n = q_n.copy()
@@ -174,13 +291,14 @@ class Agent(mp.Process):
             # On the next line, implement a trick which is known empirically to
             # reduce variance in policy gradient methods: normalize adv_n to
             # have mean zero and std=1.
-            adv_n = (adv_n - np.mean(adv_n)) / (np.std(adv_n) + 1e-8)
+            adv_n -= adv_n.mean()
+            adv_n *= 1.0 / (adv_n.std() + 1e-8)
 
         #====================================================================================#
         #                           ----------SECTION 5----------
         # Optimizing Neural Network Baseline
         #====================================================================================#
-        normalize_q_n = []
+        normalize_q_n = np.empty(0, dtype=np.float32)
         if self.nn_baseline:
             # ----------SECTION 5----------
             # If a neural network baseline is used, set up the targets and the
@@ -193,7 +311,10 @@ class Agent(mp.Process):
             # rescale the targets to have mean zero and std=1. (Goes with Hint
             # #bl1 above.)
 
-            normalize_q_n = q_n / np.std(q_n) - np.mean(q_n)
+            # q_n is not needed past this point, so normalize it in place
+            np.subtract(q_n, q_mean, out=q_n)
+            q_n *= 1.0 / (q_std + 1e-8)
+            normalize_q_n = q_n
 
         #====================================================================================#
         #                           ----------SECTION 4----------
@@ -207,19 +328,16 @@ class Agent(mp.Process):
         # function before and after an update, and then log them below.
         # endregion
 
-        # The observations, actions, and advantages are put in the same queue
-        # instead of their own separate queues to ensure the correct
-        # observations are mapped to the correction actions and advantages.
-        # Implementing these in separate multiprocessing.Queue's would not be
-        # able to guarantee the ordering.
-        self.results.put({
-            "observations": ob_no,
-            "actions": ac_na,
-            "advantages": adv_n,
-            "normalized_q_n": normalize_q_n,
-            "baseline_prediction": baseline_prediction
-        })
-        self.paths_queue.put(paths)
+        # Each agent writes to its own shared memory region, so the
+        # observations stay mapped to the correct actions and advantages
+        # without pickling them through a queue.
+        self.results.write(self._agent_id, ob_no, ac_na, adv_n, normalize_q_n,
+                           baseline_prediction)
+
+        # The supervisor only logs path statistics, so only those are sent
+        self.path_summaries.push(
+            self._agent_id, [path["reward"].sum() for path in paths],
+            [len(path["reward"]) for path in paths])
 
     def get_state_transition(self, prev_state) -> 'Agent.States':
         # State transitions are controlled by supervisor (parameter server)
@@ -240,22 +358,84 @@ class Agent(mp.Process):
     def _setup(self):
         """Initial setup code when process first spawns."""
 
-        self.env = gym.make(self.env_name)
+        # The graph seed is the same for all agents so they start from the
+        # same initial weights. Agents differ in the seeds of their
+        # environments and of their action sampling ops, so they do not
+        # collect identical trajectories.
+        agent_seed = self.seed + self._agent_id
+        np.random.seed(agent_seed)
+        tf.set_random_seed(self.seed)
 
-        discrete = isinstance(self.env.action_space, gym.spaces.Discrete)
+        env = gym.make(self.env_name)
+        discrete = isinstance(env.action_space, gym.spaces.Discrete)
 
         # Maximum length for episodes
-        self.max_path_length = self.max_path_length or self.env.spec.max_episode_steps
+        self.max_path_length = int(self.max_path_length or
+                                   env.spec.max_episode_steps)
+
+        # Discount factors for every step of the longest possible path
+        self._gamma_powers = np.power(
+            self.gamma, np.arange(self.max_path_length + 1), dtype=np.float32)
 
         # Observation and action sizes
-        ob_dim = self.env.observation_space.shape[0]
-        ac_dim = self.env.action_space.n if discrete else self.env.action_space.shape[
-            0]
+        ob_dim = env.observation_space.shape[0]
+        ac_dim = env.action_space.n if discrete else env.action_space.shape[0]
+
+        # Per step shapes and dtypes of the rollout buffers, matching the model
+        # placeholders
+        self._ob_dim = ob_dim
+        self._ac_shape = () if discrete else (ac_dim, )
+        self._ac_dtype = np.int32 if discrete else np.float32
+
+        # Converts a batch of sampled actions to what each env.step expects,
+        # specialized once here instead of handled per step in _simulate
+        self._env_actions = (Agent._discrete_env_actions if discrete else
+                             Agent._continuous_env_actions)
+
+        self._max_episode_steps = env.spec.max_episode_steps
+        if self.use_fast_rollout:
+            # Only imported when used, importing numba is slow
+            import fast_rollout
+
+            # fast_rollout steps its own implementation of the environment, so
+            # gym is only needed above for the spaces and the time limit
+            env.close()
+            fast_rollout.seed(agent_seed)
+            logger.info("Agent %d uses the compiled %s rollout",
+                        self._agent_id, self.env_name)
+        else:
+            self.envs = [env] + [
+                gym.make(self.env_name) for _ in range(self.num_envs - 1)
+            ]
+            for i, env in enumerate(self.envs):
+                env.seed(agent_seed * self.num_envs + i)
+
+        session_config = None
+        if self.pin_cpus:
+            self._pin_to_cpu()
+            session_config = tf.ConfigProto(
+                intra_op_parallelism_threads=1,
+                inter_op_parallelism_threads=1)
 
         self._model = PolicyGradient(
-            ob_dim, ac_dim, discrete, self.network_parameters["n_layers"],
+            ob_dim,
+            ac_dim,
+            discrete,
+            self.network_parameters["n_layers"],
             self.network_parameters["size"],
-            self.network_parameters["learning_rate"], self.nn_baseline)
+            self.network_parameters["learning_rate"],
+            self.nn_baseline,
+            session_config=session_config,
+            sampling_seed=self._agent_id)
+
+    def _pin_to_cpu(self):
+        """Keep this agent on one core so the small per step TF ops and env
+        steps run on a warm cache. Only the CPU affinity is set here, the
+        session's intra/inter op threads are limited in _setup."""
+        # Not available on macOS
+        if hasattr(os, "sched_setaffinity"):
+            cpus = sorted(os.sched_getaffinity(0))
+            os.sched_setaffinity(0, {cpus[self._agent_id % len(cpus)]})
 
     def run(self):
         self._setup()
@@ -273,30 +453,17 @@ class Agent(mp.Process):
                 # have picked up a ROLLOUT task. This prevents an agent that has
                 # picked up a ROLLOUT task from picking up a second ROLLOUT task
                 # until the agent transitions to another state.
-                while not self.state_queue.empty():
-                    pass
+                self.state_barrier.wait()
                 self.state_queue.task_done()
                 prev_state = Agent.States.ROLLOUT
 
             elif state is Agent.States.TRAIN:
                 _agent_debug(".TRAIN")
 
-                # Each agent puts their own result object on the queue and they
+                # Each agent writes their own results to shared memory and they
                 # need to be consolidated before training.
-                observations = []
-                actions = []
-                advantages = []
-                normalized_q_n = []
-                baseline_prediction = []
-                for _ in range(self.num_agents):
-                    results = self.results.get()
-                    observations.extend(results["observations"])
-                    actions.extend(results["actions"])
-                    advantages.extend(results["advantages"])
-                    normalized_q_n.extend(results["normalized_q_n"])
-                    baseline_prediction.extend(results["baseline_prediction"])
-
-                assert self.results.empty()
+                (observations, actions, advantages, normalized_q_n,
+                 baseline_prediction) = self.results.read()
 
                 if self.nn_baseline:
                     self._model.train_baseline(
@@ -314,29 +481,36 @@ class Agent(mp.Process):
                     else:
                         self.epoch_since_last_sync += 1
                 else:
-                    # Not ideal b/c need to put duplicate sets of weights on queue
-                    # for each agent. TODO(wy)
-                    for _ in range(self.num_agents):
-                        self.network_weights.put(weights)
+                    # Publish the weights once for all agents
+                    np.frombuffer(
+                        self.shared_weights, dtype=np.float32)[:] = weights
+                    with self.weights_generation.get_lock():
+                        self.weights_generation.value += 1
+                        generation = self.weights_generation.value
+
+                    # The trainer's model already holds these weights
+                    self._last_seen_generation = generation
                     self.state_queue.task_done()
 
                 prev_state = Agent.States.TRAIN
 
             elif state is Agent.States.UPDATE:
-                # TODO(wy): Implement logic to not update if there is only one
-                # thread since the training should have already updated the
-                # weights simultanenously
                 _agent_debug(".UDPATE")
 
                 # Check that agent is not taking two UPDATE tasks in one epoch
                 assert prev_state is not Agent.States.UPDATE
 
-                self._load_weights(self.network_weights.get())
+                # Load every published set of weights exactly once. The
+                # trainer, and so a single agent, has nothing to load.
+                generation = self.weights_generation.value
+                if generation != self._last_seen_generation:
+                    self._load_weights(
+                        np.frombuffer(self.shared_weights, dtype=np.float32))
+                    self._last_seen_generation = generation
 
-                # Hack to reduce the probability that the same agent picks up
-                # UPDATE again, before another agent who was supposed to be
-                # updated got a chance.
-                time.sleep(0.1)
+                # Same as ROLLOUT, wait until every agent has picked up its
+                # UPDATE task so that no agent picks up a second one.
+                self.state_barrier.wait()
 
                 self.state_queue.task_done()
                 prev_state = Agent.States.UPDATE
@@ -344,9 +518,7 @@ class Agent(mp.Process):
             elif state is Agent.States.TERMINATE:
                 _agent_debug(".TERMINATE")
                 self.state_queue.task_done()
-                assert self.results.empty()
                 assert self.network_weights.empty()
-                assert self.paths_queue.empty()
                 prev_state = Agent.States.TERMINATE
                 break
 
@@ -355,27 +527,32 @@ class Agent(mp.Process):
                     "Agent state queue was not one of ROLLOUT or TRAIN")
 
     @staticmethod
-    def _compute_q_values(gamma, paths, reward_to_go):
-        q_n = []
-
-        for path in paths:
-            q = 0
-            q_trajectory = []
-
-            # Calculate reward to go with gamma
-            for reward in reversed(path["reward"]):
-                q = reward + q * gamma
-                q_trajectory.append(q)
-            q_trajectory.reverse()
-
-            if not reward_to_go:
-                # All q is same as the first q (reward of full trajectory from
-                # beginning) when not doing reward to go
-                q_trajectory = [q_trajectory[0]] * len(q_trajectory)
-
-            q_n.extend(q_trajectory)
-
-        return q_n
+    def _compute_q_values(gamma, paths, reward_to_go, gamma_powers=None):
+        # Pad all paths' rewards into one matrix so every path is handled by
+        # the same vectorized call. The mask selects the valid timesteps, in
+        # path order.
+        lengths = np.array([len(path["reward"]) for path in paths])
+        max_length = lengths.max()
+        mask = np.arange(max_length) < lengths[:, None]
+
+        rewards = np.zeros((len(paths), max_length), dtype=np.float32)
+        rewards[mask] = np.concatenate([path["reward"] for path in paths])
+
+        if reward_to_go:
+            # Reverse discounted cumulative sum, q_t = r_t + gamma * q_t+1,
+            # evaluated as a single IIR filter over the reversed rewards. The
+            # padding ends up in front of each reversed path and filters to 0.
+            q = scipy.signal.lfilter(
+                [1.0], [1.0, -gamma], rewards[:, ::-1], axis=1)[:, ::-1]
+            return q[mask].astype(np.float32)
+
+        # All q is the discounted reward of the full trajectory from the
+        # beginning when not doing reward to go
+        if gamma_powers is None:
+            gamma_powers = np.power(
+                gamma, np.arange(max_length), dtype=np.float32)
+        returns = rewards.dot(gamma_powers[:max_length])
+        return np.repeat(returns, lengths).astype(np.float32)
 
     def _train(self, observations, actions, advantages):
         return self._model.train_agent(observations, actions, advantages)
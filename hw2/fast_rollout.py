@@ -0,0 +1,164 @@
+"""Numba compiled rollouts for environments simple enough to reimplement,
+stepping the environment and sampling from the policy network in one compiled
+loop instead of a Python loop over gym and TF calls."""
+import math
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # Optional, Agent falls back to stepping gym
+    numba = None
+
+# Environments with a compiled implementation. CartPole-v0 and v1 only differ
+# in their time limit which comes from the env spec.
+SUPPORTED_ENVS = ("CartPole-v0", "CartPole-v1")
+
+# CartPole physics, same constants as gym.envs.classic_control.CartPoleEnv
+_GRAVITY = 9.8
+_MASSCART = 1.0
+_MASSPOLE = 0.1
+_TOTAL_MASS = _MASSPOLE + _MASSCART
+_LENGTH = 0.5  # actually half the pole's length
+_POLEMASS_LENGTH = _MASSPOLE * _LENGTH
+_FORCE_MAG = 10.0
+_TAU = 0.02  # seconds between state updates
+_THETA_THRESHOLD_RADIANS = 12 * 2 * math.pi / 360
+_X_THRESHOLD = 2.4
+
+
+def available(env_name):
+    """Whether rollout() can be used in place of gym for this environment."""
+    return numba is not None and env_name in SUPPORTED_ENVS
+
+
+def _njit(function):
+    if numba is None:
+        return function
+    return numba.njit(cache=True, fastmath=True)(function)
+
+
+@_njit
+def seed(seed):
+    """Seed the random number generator used by the compiled code, which is
+    separate from numpy's global one."""
+    np.random.seed(seed)
+
+
+@_njit
+def _mlp(x, flat_weights, layer_sizes):
+    # Same network as model.build_mlp with relu hidden layers, reading each
+    # dense layer's kernel and bias in the order of the flat weights
+    offset = 0
+    n_layers = len(layer_sizes) - 1
+    for layer in range(n_layers):
+        n_in = layer_sizes[layer]
+        n_out = layer_sizes[layer + 1]
+        kernel = flat_weights[offset:offset + n_in * n_out].reshape(
+            (n_in, n_out))
+        offset += n_in * n_out
+        bias = flat_weights[offset:offset + n_out]
+        offset += n_out
+
+        x = np.dot(x, kernel) + bias
+        if layer < n_layers - 1:
+            x = np.maximum(x, 0)
+    return x
+
+
+@_njit
+def _sample_action(ob, flat_weights, layer_sizes):
+    logits = _mlp(ob, flat_weights, layer_sizes)
+    cumulative = np.cumsum(np.exp(logits - logits.max()))
+    return np.searchsorted(cumulative, np.random.random() * cumulative[-1],
+                           side='right')
+
+
+@_njit
+def _cartpole_step(state, action):
+    x, x_dot, theta, theta_dot = state[0], state[1], state[2], state[3]
+    force = _FORCE_MAG if action == 1 else -_FORCE_MAG
+    costheta = math.cos(theta)
+    sintheta = math.sin(theta)
+    temp = (force + _POLEMASS_LENGTH * theta_dot * theta_dot * sintheta
+            ) / _TOTAL_MASS
+    thetaacc = (_GRAVITY * sintheta - costheta * temp) / (
+        _LENGTH * (4.0 / 3.0 - _MASSPOLE * costheta * costheta / _TOTAL_MASS))
+    xacc = temp - _POLEMASS_LENGTH * thetaacc * costheta / _TOTAL_MASS
+
+    state[0] = x + _TAU * x_dot
+    state[1] = x_dot + _TAU * xacc
+    state[2] = theta + _TAU * theta_dot
+    state[3] = theta_dot + _TAU * thetaacc
+
+    return (state[0] < -_X_THRESHOLD or state[0] > _X_THRESHOLD
+            or state[2] < -_THETA_THRESHOLD_RADIANS
+            or state[2] > _THETA_THRESHOLD_RADIANS)
+
+
+@_njit
+def _rollout_cartpole(flat_weights, layer_sizes, max_steps, min_timesteps):
+    # Paths are collected until there are more than min_timesteps, so the
+    # last one starts at most at floor(min_timesteps)
+    capacity = int(min_timesteps) + max_steps
+    obs = np.empty((capacity, 4), dtype=np.float32)
+    acs = np.empty(capacity, dtype=np.int32)
+    path_lengths = np.empty(capacity, dtype=np.int64)
+
+    timesteps = 0
+    n_paths = 0
+    state = np.empty(4)
+    while timesteps <= min_timesteps:
+        state[:] = np.random.uniform(-0.05, 0.05, 4)
+        steps = 0
+        done = False
+        while not done:
+            obs[timesteps] = state
+            action = _sample_action(obs[timesteps], flat_weights, layer_sizes)
+            acs[timesteps] = action
+            done = _cartpole_step(state, action)
+            timesteps += 1
+            steps += 1
+            done = done or steps >= max_steps
+
+        path_lengths[n_paths] = steps
+        n_paths += 1
+
+    return obs[:timesteps], acs[:timesteps], path_lengths[:n_paths]
+
+
+def rollout(env_name, flat_weights, layer_sizes, max_steps, min_timesteps):
+    """Collect paths with a discrete MLP policy until there are more than
+    min_timesteps timesteps, like Agent._simulate.
+
+    Arguments:
+        env_name {string} -- One of SUPPORTED_ENVS
+        flat_weights {np.ndarray} -- Flat float32 weights from
+            PolicyGradient.dump_weights, starting with the policy network
+        layer_sizes {list} -- Layer sizes of the policy network
+        max_steps {integer} -- Maximum number of steps of a path
+        min_timesteps {float} -- Timesteps to exceed before returning
+
+    Returns:
+        tuple -- List of paths and the total number of timesteps
+    """
+    if env_name not in SUPPORTED_ENVS:
+        raise ValueError("No compiled rollout for " + env_name)
+
+    obs, acs, path_lengths = _rollout_cartpole(
+        np.ascontiguousarray(flat_weights, dtype=np.float32),
+        np.asarray(layer_sizes, dtype=np.int64), max_steps, min_timesteps)
+
+    # CartPole gives a reward of 1 on every step, including the last one
+    paths = []
+    offset = 0
+    for length in path_lengths:
+        end = offset + length
+        paths.append({
+            "observation": obs[offset:end],
+            "reward": np.ones(length, dtype=np.float32),
+            "action": acs[offset:end]
+        })
+        offset = end
+
+    return paths, len(acs)
@@ -0,0 +1,190 @@
+import multiprocessing as mp
+
+import numpy as np
+
+# Number of 8 byte words in a 64 byte cache line
+_CACHE_LINE_WORDS = 8
+
+
+class SharedResults:
+    def __init__(self, num_agents, capacity, ob_dim, ac_dim, discrete,
+                 nn_baseline):
+        """Shared memory regions, one per agent, holding the training batch of
+        each agent's last rollout. Replaces pickling the batches through a
+        multiprocessing.Queue.
+
+        Must be created before the agents are started so that the memory is
+        inherited by every agent process.
+
+        Arguments:
+            num_agents {integer} -- Number of agents writing results
+            capacity {integer} -- Maximum number of timesteps per agent batch
+            ob_dim {integer} -- Observation space dimensions
+            ac_dim {integer} -- Action space dimensions
+            discrete {boolean} -- Whether the actions are discrete
+            nn_baseline {boolean} -- Whether baseline targets are shared too
+        """
+
+        self.capacity = capacity
+        self.ob_dim = ob_dim
+        self.ac_shape = () if discrete else (ac_dim, )
+        self.ac_dtype = np.int32 if discrete else np.float32
+        self.nn_baseline = nn_baseline
+
+        ac_size = 1 if discrete else ac_dim
+        ac_typecode = 'i' if discrete else 'f'
+
+        def allocate(typecode, size):
+            return [mp.RawArray(typecode, size) for _ in range(num_agents)]
+
+        self._observations = allocate('f', capacity * ob_dim)
+        self._actions = allocate(ac_typecode, capacity * ac_size)
+        self._advantages = allocate('f', capacity)
+        if nn_baseline:
+            self._normalized_q_n = allocate('f', capacity)
+            self._baseline_prediction = allocate('f', capacity)
+
+        # Number of valid timesteps in each agent's region. Every agent's
+        # length is padded to its own cache line to avoid false sharing.
+        self._lengths = mp.RawArray('Q', num_agents * _CACHE_LINE_WORDS)
+
+    def _views(self, agent_id):
+        # Views are created on demand rather than stored, so only the raw
+        # shared arrays are ever inherited or pickled
+        views = [
+            np.frombuffer(self._observations[agent_id],
+                          dtype=np.float32).reshape(self.capacity,
+                                                    self.ob_dim),
+            np.frombuffer(self._actions[agent_id],
+                          dtype=self.ac_dtype).reshape(
+                              (self.capacity, ) + self.ac_shape),
+            np.frombuffer(self._advantages[agent_id], dtype=np.float32)
+        ]
+        if self.nn_baseline:
+            views.append(
+                np.frombuffer(
+                    self._normalized_q_n[agent_id], dtype=np.float32))
+            views.append(
+                np.frombuffer(
+                    self._baseline_prediction[agent_id], dtype=np.float32))
+        return views
+
+    def write(self, agent_id, observations, actions, advantages,
+              normalized_q_n, baseline_prediction):
+        """Copy one agent's batch into its own region."""
+        length = len(observations)
+        if length > self.capacity:
+            raise ValueError(
+                "Batch of {} timesteps does not fit in shared results of "
+                "capacity {}".format(length, self.capacity))
+
+        arrays = [observations, actions, advantages]
+        if self.nn_baseline:
+            arrays.extend([normalized_q_n, baseline_prediction])
+
+        for view, array in zip(self._views(agent_id), arrays):
+            view[:length] = array
+
+        self._lengths[agent_id * _CACHE_LINE_WORDS] = length
+
+    def read(self):
+        """Concatenate the batches of all agents.
+
+        Returns:
+            tuple -- observations, actions, advantages, normalized_q_n and
+                baseline_prediction. The last two are empty without an nn
+                baseline. With a single agent the arrays are views into its
+                shared region.
+        """
+        per_agent = [[view[:length] for view in self._views(agent_id)]
+                     for agent_id, length in enumerate(
+                         self._lengths[::_CACHE_LINE_WORDS])]
+
+        # A single agent's slices can be trained on directly, the region is
+        # not written again until the next rollout
+        if len(per_agent) == 1:
+            results = per_agent[0]
+        else:
+            results = [np.concatenate(arrays) for arrays in zip(*per_agent)]
+
+        if not self.nn_baseline:
+            results.extend([np.empty(0, dtype=np.float32)] * 2)
+        return tuple(results)
+
+
+class PathSummaries:
+    def __init__(self, num_agents, capacity):
+        """Bounded single producer, single consumer rings, one per agent,
+        carrying the return and length of every path an agent collects to the
+        supervisor. Replaces pickling whole paths through a
+        multiprocessing.Queue when the supervisor only logs these statistics.
+
+        Must be created before the agents are started so that the memory is
+        inherited by every agent process.
+
+        Arguments:
+            num_agents {integer} -- Number of agents, each producing into its
+                own ring
+            capacity {integer} -- Maximum number of unconsumed path summaries
+                per agent
+        """
+
+        self.capacity = capacity
+
+        # Monotonic head (next record to write, owned by the producer) and tail
+        # (next record to read, owned by the consumer) counters. Each sits on
+        # its own cache line so producer and consumer never write to the same
+        # line.
+        self._indices = [
+            mp.RawArray('Q', 2 * _CACHE_LINE_WORDS) for _ in range(num_agents)
+        ]
+
+        # (return, length) records
+        self._records = [
+            mp.RawArray('d', 2 * capacity) for _ in range(num_agents)
+        ]
+
+    def _ring(self, agent_id):
+        return np.frombuffer(
+            self._records[agent_id], dtype=np.float64).reshape(
+                self.capacity, 2)
+
+    def push(self, agent_id, returns, lengths):
+        """Append path summaries to an agent's ring. Only to be called by that
+        agent."""
+        indices = self._indices[agent_id]
+        head = indices[0]
+        tail = indices[_CACHE_LINE_WORDS]
+        count = len(returns)
+        if head + count - tail > self.capacity:
+            raise ValueError(
+                "{} path summaries do not fit in ring of capacity {} holding "
+                "{} unconsumed summaries".format(count, self.capacity,
+                                                 head - tail))
+
+        slots = np.arange(head, head + count) % self.capacity
+        ring = self._ring(agent_id)
+        ring[slots, 0] = returns
+        ring[slots, 1] = lengths
+
+        # Publish only after the records are written
+        indices[0] = head + count
+
+    def pop_all(self):
+        """Consume all published path summaries of all agents.
+
+        Returns:
+            tuple -- Arrays of path returns and path lengths
+        """
+        records = []
+        for agent_id, indices in enumerate(self._indices):
+            head = indices[0]
+            tail = indices[_CACHE_LINE_WORDS]
+            slots = np.arange(tail, head) % self.capacity
+            records.append(self._ring(agent_id)[slots])
+
+            # Release the slots only after the records are copied out
+            indices[_CACHE_LINE_WORDS] = head
+
+        records = np.concatenate(records)
+        return records[:, 0], records[:, 1].astype(np.int64)
@@ -42,9 +42,31 @@ def build_mlp(input_placeholder,
         return output
 
 
+def mlp_layer_sizes(input_size, output_size, n_layers=2, size=64):
+    """Sizes of the input, hidden and output layers of build_mlp for the same
+    arguments."""
+    return [input_size] + [size] * n_layers + [output_size]
+
+
+def mlp_num_parameters(input_size, output_size, n_layers=2, size=64):
+    """Number of trainable parameters created by build_mlp for the same
+    arguments (weights and biases of every dense layer)."""
+    layer_sizes = mlp_layer_sizes(input_size, output_size, n_layers, size)
+    return sum((n_in + 1) * n_out
+               for n_in, n_out in zip(layer_sizes[:-1], layer_sizes[1:]))
+
+
 class PolicyGradient:
-    def __init__(self, ob_dim, ac_dim, discrete, n_layers, size, learning_rate,
-                 nn_baseline):
+    def __init__(self,
+                 ob_dim,
+                 ac_dim,
+                 discrete,
+                 n_layers,
+                 size,
+                 learning_rate,
+                 nn_baseline,
+                 session_config=None,
+                 sampling_seed=None):
         """Implementation of policy gradient neural network, with ability to load/dump weights.
 
         Arguments:
@@ -55,8 +77,21 @@ class PolicyGradient:
             size {integer} -- Size of each hidden layer in the MLP
             learning_rate {float} -- Learning rate of the MLP
             nn_baseline {boolean} -- Whether to use a neural network baseline
+
+        Keyword Arguments:
+            session_config {tf.ConfigProto} -- Config of the session the model
+                runs in (default: {None})
+            sampling_seed {integer} -- Op seed of the action sampling ops, so
+                models sharing a graph seed sample different noise
+                (default: {None})
         """
 
+        # The model is built from placeholders and run through a session
+        if tf.executing_eagerly():
+            raise RuntimeError(
+                "PolicyGradient needs graph mode, but eager execution is "
+                "enabled")
+
         #========================================================================================#
         #                           ----------SECTION 4----------
         # Placeholders
@@ -118,9 +153,11 @@ class PolicyGradient:
 
         if discrete:
             sy_logits_na = build_mlp(self.sy_ob_no, ac_dim, scope="discrete")
+            # Layout of the logits network at the start of the flat weights
+            self.policy_layer_sizes = mlp_layer_sizes(ob_dim, ac_dim)
             # Hint: Use the tf.multinomial op
             self.sy_sampled_ac = tf.squeeze(
-                tf.multinomial(sy_logits_na, 1), axis=1)
+                tf.multinomial(sy_logits_na, 1, seed=sampling_seed), axis=1)
             sy_logprob_n = tf.nn.sparse_softmax_cross_entropy_with_logits(
                 labels=self.sy_ac_na, logits=sy_logits_na)
 
@@ -131,11 +168,13 @@ class PolicyGradient:
                 scope="continuous",
                 n_layers=n_layers,
                 size=size)
+            self.policy_layer_sizes = mlp_layer_sizes(ob_dim, ac_dim, n_layers,
+                                                      size)
             # logstd should just be a trainable variable, not a network output.
             sy_logstd = tf.get_variable("logstd", [ac_dim])
             sy_std = tf.exp(sy_logstd)
             self.sy_sampled_ac = sy_mean + sy_std * \
-                tf.random_normal(tf.shape(sy_mean))
+                tf.random_normal(tf.shape(sy_mean), seed=sampling_seed)
             # Hint: Use the log probability under a multivariate gaussian.
             sy_logprob_n = 0.5 * \
                 tf.reduce_sum(tf.square(sy_mean - self.sy_ac_na) / sy_std, 1)
@@ -168,12 +207,42 @@ class PolicyGradient:
             self.baseline_update_op = tf.train.AdamOptimizer(
                 learning_rate).minimize(baseline_loss)
 
-        self.sess = tf.Session()
+        #======================================================================#
+        # Flat weights
+        #
+        # All trainable variables are dumped and loaded as one flat float32
+        # vector so they can be shared between agents without pickling.
+        #======================================================================#
+
+        variables = tf.trainable_variables()
+        self._flat_weights = tf.concat(
+            [tf.reshape(v, [-1]) for v in variables], axis=0)
+        self.sy_flat_weights = tf.placeholder(
+            shape=self._flat_weights.shape, name="flat_weights",
+            dtype=tf.float32)
+
+        assign_ops = []
+        offset = 0
+        for v in variables:
+            n = v.shape.num_elements()
+            assign_ops.append(
+                tf.assign(v,
+                          tf.reshape(self.sy_flat_weights[offset:offset + n],
+                                     v.shape)))
+            offset += n
+        self._load_weights_op = tf.group(*assign_ops)
+
+        self.sess = tf.Session(config=session_config)
         self.sess.run(tf.global_variables_initializer())
 
+        # Action sampling runs once per environment step, so prebuild the
+        # callable to skip the feed/fetch bookkeeping of sess.run on each call
+        self._sample_action = self.sess.make_callable(
+            self.sy_sampled_ac, feed_list=[self.sy_ob_no])
+
     def run_agent(self, observations):
-        return self.sess.run(
-            self.sy_sampled_ac, feed_dict={self.sy_ob_no: observations[None]})
+        """Sample actions for a batch of observations, shape [None, ob_dim]"""
+        return self._sample_action(observations)
 
     def predict_baseline(self, observations):
         # TODO(wy): Breakout baseline prediction as its own class
@@ -205,15 +274,31 @@ class PolicyGradient:
         return self.dump_weights()
 
     def dump_weights(self):
+        """Return all trainable variables as one flat float32 vector."""
         logger.debug("Dumping weights...")
-        weights = {}
-        for v in tf.trainable_variables():
-            weights[v.name] = self.sess.run(v)
-        return weights
+        return self.sess.run(self._flat_weights)
 
     def load_weights(self, weights):
+        """Assign all trainable variables from a flat vector laid out like the
+        output of dump_weights."""
         logger.debug("Loading weights...")
-        for v in tf.trainable_variables():
-            self.sess.run(tf.assign(v, weights[v.name]))
+        assert len(weights) == self._flat_weights.shape[0]
+
+        self.sess.run(
+            self._load_weights_op, feed_dict={self.sy_flat_weights: weights})
+
+    @staticmethod
+    def num_parameters(ob_dim, ac_dim, discrete, n_layers, size, nn_baseline):
+        """Length of the flat weight vector of a PolicyGradient built with the
+        same arguments, without having to build the graph."""
+        if discrete:
+            num_parameters = mlp_num_parameters(ob_dim, ac_dim)
+        else:
+            # Policy mean network and the logstd variable
+            num_parameters = mlp_num_parameters(ob_dim, ac_dim, n_layers,
+                                                size) + ac_dim
+
+        if nn_baseline:
+            num_parameters += mlp_num_parameters(ob_dim, 1, n_layers, size)
 
-        assert len(weights) == len(tf.trainable_variables())
+        return num_parameters
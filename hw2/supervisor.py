@@ -6,10 +6,10 @@ import time
 
 import gym
 import numpy as np
-import tensorflow as tf
 
 import logz
 from agent import Agent
+from ipc import PathSummaries, SharedResults
 from model import PolicyGradient
 
 logger = logging.getLogger(__name__)
@@ -61,10 +61,25 @@ class Supervisor(mp.Process):
             n_layers=1,
             size=32,
             num_agents=1,
-            async_transitions=False):
+            async_transitions=False,
+            num_envs=1,
+            pin_cpus=False,
+            use_fast_rollout=False):
 
         if num_agents < 1:
             raise ValueError("Need at least 1 agent to do the rollout")
+        if num_envs < 1:
+            raise ValueError("Need at least 1 environment per agent")
+        if use_fast_rollout:
+            # Only imported when used, importing numba is slow
+            import fast_rollout
+            if not fast_rollout.available(env_name):
+                raise ValueError(
+                    "Compiled rollouts need numba and one of " +
+                    ", ".join(fast_rollout.SUPPORTED_ENVS))
+            if num_envs != 1:
+                raise ValueError(
+                    "Compiled rollouts step a single environment per agent")
 
         mp.Process.__init__(self)
 
@@ -87,8 +102,11 @@ class Supervisor(mp.Process):
 
         self.state = self.States.WAITING_FOR_PARAMETERS
         self.num_agents = num_agents
+        self.num_envs = num_envs
+        self.pin_cpus = pin_cpus
+        self.use_fast_rollout = use_fast_rollout
 
-        tf.set_random_seed(seed)
+        # TF is only seeded by the agents that build models
         np.random.seed(seed)
 
         # Configure logz
@@ -102,20 +120,57 @@ class Supervisor(mp.Process):
     def run(self):
         start = time.time()
 
-        results = mp.Queue()
-        paths_queue = mp.Queue()
         agent_state = mp.JoinableQueue()  # Synchronize state of all agents
         network_weights = mp.Queue()
 
+        # Shared memory has to be sized before the agents are started, so
+        # look up the environment dimensions here
+        env = gym.make(self.env_name)
+        discrete = isinstance(env.action_space, gym.spaces.Discrete)
+        ob_dim = env.observation_space.shape[0]
+        ac_dim = env.action_space.n if discrete else env.action_space.shape[0]
+        max_path_length = int(self.max_path_length or
+                              env.spec.max_episode_steps)
+        env.close()
+
+        # An agent stops starting new paths once it has more than its share of
+        # timesteps, but still completes the path in progress in each of its
+        # environments, which can be up to max_path_length + 1 long
+        timesteps_per_agent = int(
+            self.min_timesteps_per_batch /
+            self.num_agents) + self.num_envs * (max_path_length + 1)
+        results = SharedResults(self.num_agents, timesteps_per_agent, ob_dim,
+                                ac_dim, discrete, self.nn_baseline)
+
+        # Summaries are consumed every epoch and every path is at least one
+        # timestep long
+        path_summaries = PathSummaries(self.num_agents, timesteps_per_agent)
+
+        # Flat network weights are shared between agents through shared memory
+        # instead of being pickled on a queue once per agent
+        num_parameters = PolicyGradient.num_parameters(
+            ob_dim, ac_dim, discrete, self.network_parameters["n_layers"],
+            self.network_parameters["size"], self.nn_baseline)
+        shared_weights = mp.RawArray('f', num_parameters)
+        weights_generation = mp.Value('Q', 0)
+        state_barrier = mp.Barrier(self.num_agents)
+
         # Initialize students processes that will perform the rollouts
         agents = []
-        for _ in range(self.num_agents):
+        for agent_id in range(self.num_agents):
             agents.append(
                 Agent(self.env_name, self.gamma, self.min_timesteps_per_batch,
                       self.max_path_length, self.reward_to_go,
                       self.normalize_advantages, self.nn_baseline, self.seed,
                       self.network_parameters, results, agent_state,
-                      network_weights, paths_queue, self.num_agents))
+                      network_weights, path_summaries, self.num_agents,
+                      num_envs=self.num_envs,
+                      shared_weights=shared_weights,
+                      weights_generation=weights_generation,
+                      state_barrier=state_barrier,
+                      agent_id=agent_id,
+                      pin_cpus=self.pin_cpus,
+                      use_fast_rollout=self.use_fast_rollout))
 
         for agent in agents:
             agent.start()
@@ -127,27 +182,20 @@ class Supervisor(mp.Process):
                 agent_state.put(Agent.States.ROLLOUT)
             agent_state.join()
 
-            paths = []
-            for _ in range(self.num_agents):
-                paths.extend(paths_queue.get())
-
-            # There should be only /num_agents/ instances of /path/ appeneded
-            # to the /paths_queue/
-            assert paths_queue.empty()
+            returns, ep_lengths = path_summaries.pop_all()
 
             agent_state.put(Agent.States.TRAIN)
             agent_state.join()
 
-            # Not ideal because the trainer which already has updated weights
-            # will also concidentally pick up an UDPATE task for ease of
-            # implementation. TODO(wy)
-            for _ in range(self.num_agents):
-                agent_state.put(Agent.States.UPDATE)
-            agent_state.join()
+            # Every agent picks up one UPDATE task. The trainer already has the
+            # new weights and skips loading them, so a single agent does not
+            # need to update at all.
+            if self.num_agents > 1:
+                for _ in range(self.num_agents):
+                    agent_state.put(Agent.States.UPDATE)
+                agent_state.join()
 
             # Log diagnostics
-            returns = [path["reward"].sum() for path in paths]
-            ep_lengths = [len(path["reward"]) for path in paths]
             logz.log_tabular("Time", time.time() - start)
             logz.log_tabular("Iteration", itr)
             logz.log_tabular("AverageReturn", np.mean(returns))
@@ -1,8 +1,10 @@
 import unittest
 from unittest.mock import MagicMock, Mock, patch
 
+import numpy as np
+
 from agent import Agent
-from multiprocessing import JoinableQueue
+from multiprocessing import Barrier, JoinableQueue, RawArray, Value
 import time
 import logging
 import sys
@@ -42,11 +44,21 @@ class TestAgent(unittest.TestCase):
         mock_agent2.network_weights = mock_joinable_queue
         mock_agent1.results = mock_joinable_queue
         mock_agent2.results = mock_joinable_queue
-        mock_agent1.paths_queue = mock_joinable_queue
-        mock_agent2.paths_queue = mock_joinable_queue
         mock_agent1._load_weights = MagicMock(Agent._load_weights)
         mock_agent2._load_weights = MagicMock(Agent._load_weights)
 
+        # Pretend a set of weights has already been published by a trainer
+        shared_weights = RawArray('f', 1)
+        weights_generation = Value('Q', 1)
+        mock_agent1.shared_weights = shared_weights
+        mock_agent2.shared_weights = shared_weights
+        mock_agent1.weights_generation = weights_generation
+        mock_agent2.weights_generation = weights_generation
+
+        state_barrier = Barrier(2)
+        mock_agent1.state_barrier = state_barrier
+        mock_agent2.state_barrier = state_barrier
+
         # Spawn agents
         mock_agent1.start()
         mock_agent2.start()
@@ -62,6 +74,74 @@ class TestAgent(unittest.TestCase):
         mock_agent1.join()
         mock_agent2.join()
 
+    def test_simulate_keeps_paths_in_progress(self):
+        """With several environments, every step taken is part of a returned
+        path, including the paths still in progress when the batch filled up.
+        """
+
+        class StubEnv:
+            def __init__(self, path_length):
+                self.path_length = path_length
+                self.total_steps = 0
+
+            def reset(self):
+                self.t = 0
+                return np.zeros(4)
+
+            def step(self, action):
+                self.t += 1
+                self.total_steps += 1
+                return np.full(4, self.t), 1.0, self.t >= self.path_length, {}
+
+        class StubModel:
+            def run_agent(self, observations):
+                return np.zeros(len(observations), dtype=np.int64)
+
+        agent = Agent(min_timesteps_per_batch=10, num_envs=3)
+        agent.envs = [StubEnv(2), StubEnv(7), StubEnv(30)]
+        agent._model = StubModel()
+        agent.max_path_length = 50
+        agent._ob_dim = 4
+        agent._ac_shape = ()
+        agent._ac_dtype = np.int32
+        agent._env_actions = Agent._discrete_env_actions
+
+        paths, timesteps = agent._simulate()
+
+        self.assertGreater(timesteps, 10)
+        self.assertEqual(timesteps, sum(len(path["reward"]) for path in paths))
+        self.assertEqual(timesteps, sum(env.total_steps for env in agent.envs))
+        # The longest path was still in progress when the batch filled up
+        self.assertIn(30, [len(path["reward"]) for path in paths])
+        for path in paths:
+            np.testing.assert_array_equal(
+                path["observation"][:, 0], np.arange(len(path["reward"])))
+
+    def test_compute_q_values(self):
+        """Compare the vectorized q values against a direct evaluation of the
+        discounted sums.
+        """
+        gamma = 0.9
+        paths = [{
+            "reward": np.array([1.0, 2.0, 3.0])
+        }, {
+            "reward": np.array([0.5])
+        }]
+
+        q_n = Agent._compute_q_values(gamma, paths, reward_to_go=True)
+        np.testing.assert_allclose(
+            q_n, [1 + 0.9 * 2 + 0.81 * 3, 2 + 0.9 * 3, 3, 0.5])
+
+        q_n = Agent._compute_q_values(gamma, paths, reward_to_go=False)
+        np.testing.assert_allclose(q_n, [1 + 0.9 * 2 + 0.81 * 3] * 3 + [0.5])
+
+        gamma_powers = np.power(gamma, np.arange(10), dtype=np.float32)
+        np.testing.assert_allclose(
+            Agent._compute_q_values(
+                gamma, paths, reward_to_go=False, gamma_powers=gamma_powers),
+            q_n,
+            rtol=1e-6)
+
     # def test_something_else(self):
     # 	my_thing = MyClass()
     #     assertNotEqual(my_thing('a'), my_thing('b'))
@@ -0,0 +1,65 @@
+import unittest
+
+import gym
+import numpy as np
+
+import fast_rollout
+
+
+class TestFastRollout(unittest.TestCase):
+    def setUp(self):
+        self.layer_sizes = [4, 8, 2]
+        num_parameters = sum((n_in + 1) * n_out
+                             for n_in, n_out in zip(self.layer_sizes[:-1],
+                                                    self.layer_sizes[1:]))
+        self.weights = np.random.randn(num_parameters).astype(np.float32)
+        fast_rollout.seed(0)
+
+    def test_rollout_paths(self):
+        max_steps = 20
+        paths, timesteps = fast_rollout.rollout(
+            "CartPole-v0", self.weights, self.layer_sizes, max_steps, 100)
+
+        self.assertGreater(timesteps, 100)
+        self.assertEqual(timesteps, sum(len(path["reward"]) for path in paths))
+        for path in paths:
+            self.assertLessEqual(len(path["reward"]), max_steps)
+            self.assertEqual(len(path["observation"]), len(path["reward"]))
+            self.assertEqual(len(path["action"]), len(path["reward"]))
+            self.assertTrue(np.all(np.isin(path["action"], [0, 1])))
+            np.testing.assert_array_equal(path["reward"], 1)
+
+    def test_mlp_matches_dense_layers(self):
+        ob = np.random.randn(4).astype(np.float32)
+
+        hidden_kernel = self.weights[:32].reshape(4, 8)
+        hidden_bias = self.weights[32:40]
+        output_kernel = self.weights[40:56].reshape(8, 2)
+        output_bias = self.weights[56:]
+        expected = np.maximum(ob.dot(hidden_kernel) + hidden_bias, 0).dot(
+            output_kernel) + output_bias
+
+        np.testing.assert_allclose(
+            fast_rollout._mlp(ob, self.weights,
+                              np.array(self.layer_sizes)),
+            expected,
+            rtol=1e-5)
+
+    def test_cartpole_step_matches_gym(self):
+        env = gym.make("CartPole-v0").unwrapped
+        env.seed(0)
+        env.reset()
+        state = np.array(env.state, dtype=np.float64)
+
+        for action in [1, 1, 0, 1, 0, 0, 0, 1] * 25:
+            ob, _, done, _ = env.step(action)
+            self.assertEqual(
+                fast_rollout._cartpole_step(state, action), done)
+            np.testing.assert_allclose(state, ob, rtol=1e-6, atol=1e-9)
+            if done:
+                break
+        env.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+
+from ipc import PathSummaries, SharedResults
+
+
+class TestSharedResults(unittest.TestCase):
+    def test_read_concatenates_agent_batches(self):
+        results = SharedResults(
+            num_agents=2,
+            capacity=4,
+            ob_dim=3,
+            ac_dim=2,
+            discrete=False,
+            nn_baseline=True)
+
+        batches = []
+        for agent_id, length in enumerate([4, 2]):
+            batch = (np.random.random((length, 3)),
+                     np.random.random((length, 2)), np.random.random(length),
+                     np.random.random(length), np.random.random(length))
+            results.write(agent_id, *batch)
+            batches.append(batch)
+
+        for read, *written in zip(results.read(), *batches):
+            self.assertEqual(read.dtype, np.float32)
+            np.testing.assert_allclose(read, np.concatenate(written), rtol=1e-6)
+
+    def test_discrete_without_baseline(self):
+        results = SharedResults(
+            num_agents=1,
+            capacity=3,
+            ob_dim=2,
+            ac_dim=4,
+            discrete=True,
+            nn_baseline=False)
+
+        empty = np.empty(0, dtype=np.float32)
+        results.write(0, np.ones((3, 2)), np.array([0, 3, 1]), np.ones(3),
+                      empty, empty)
+        _, actions, _, normalized_q_n, baseline_prediction = results.read()
+
+        self.assertEqual(actions.dtype, np.int32)
+        np.testing.assert_array_equal(actions, [0, 3, 1])
+        self.assertEqual(len(normalized_q_n), 0)
+        self.assertEqual(len(baseline_prediction), 0)
+
+        with self.assertRaises(ValueError):
+            results.write(0, np.ones((4, 2)), np.zeros(4), np.ones(4), empty,
+                          empty)
+
+
+class TestPathSummaries(unittest.TestCase):
+    def test_pop_all_wraps_around(self):
+        summaries = PathSummaries(num_agents=2, capacity=3)
+
+        # Fill and drain repeatedly so the indices wrap past the capacity
+        for epoch in range(4):
+            summaries.push(0, [epoch, epoch + 1.5], [1, 2])
+            summaries.push(1, [10.0 * epoch], [7])
+            returns, lengths = summaries.pop_all()
+
+            np.testing.assert_array_equal(
+                returns, [epoch, epoch + 1.5, 10.0 * epoch])
+            np.testing.assert_array_equal(lengths, [1, 2, 7])
+
+        returns, lengths = summaries.pop_all()
+        self.assertEqual(len(returns), 0)
+        self.assertEqual(len(lengths), 0)
+
+    def test_push_past_capacity(self):
+        summaries = PathSummaries(num_agents=1, capacity=2)
+        summaries.push(0, [1.0], [1])
+        with self.assertRaises(ValueError):
+            summaries.push(0, [1.0, 2.0], [1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
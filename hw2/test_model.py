@@ -55,3 +55,51 @@ class TestModel(unittest.TestCase):
         print(
             "\nBatch size of {batch_size} took {training_time:.2f}s to train".
             format(batch_size=BATCH_SIZE, training_time=(end - start)))
+
+    def test_flat_weights_round_trip(self):
+        try:
+            self.model
+        except AttributeError:
+            self.setUpClass()
+
+        weights = self.model.dump_weights()
+        self.assertEqual(
+            len(weights),
+            PolicyGradient.num_parameters(
+                ob_dim=self.ob_dim,
+                ac_dim=self.ac_dim,
+                discrete=False,
+                n_layers=2,
+                size=32,
+                nn_baseline=True))
+
+        self.model.load_weights(np.zeros_like(weights))
+        np.testing.assert_array_equal(self.model.dump_weights(), 0)
+
+        self.model.load_weights(weights)
+        np.testing.assert_array_equal(self.model.dump_weights(), weights)
+
+    def test_sampling_seed_separates_action_noise(self):
+        # Models built with the same graph seed, as every agent does
+        models = []
+        for sampling_seed in [0, 1]:
+            with tf.Graph().as_default():
+                tf.set_random_seed(0)
+                models.append(
+                    PolicyGradient(
+                        ob_dim=self.ob_dim,
+                        ac_dim=self.ac_dim,
+                        discrete=False,
+                        n_layers=2,
+                        size=32,
+                        learning_rate=5e-2,
+                        nn_baseline=True,
+                        sampling_seed=sampling_seed))
+
+        np.testing.assert_array_equal(models[0].dump_weights(),
+                                      models[1].dump_weights())
+
+        observations = np.zeros((10, self.ob_dim))
+        self.assertFalse(
+            np.array_equal(models[0].run_agent(observations),
+                           models[1].run_agent(observations)))
@@ -47,6 +47,9 @@ def main():
     parser.add_argument('--size', '-s', type=int, default=32)
     parser.add_argument('--num_agents', type=int, default=1)
     parser.add_argument('--async_transitions', action='store_true')
+    parser.add_argument('--num_envs', type=int, default=1)
+    parser.add_argument('--pin_cpus', action='store_true')
+    parser.add_argument('--fast_rollout', action='store_true')
     args = parser.parse_args()
 
     if not (os.path.exists('data')):
@@ -80,7 +83,10 @@ def main():
             n_layers=args.n_layers,
             size=args.size,
             num_agents=args.num_agents,
-            async_transitions=args.async_transitions)
+            async_transitions=args.async_transitions,
+            num_envs=args.num_envs,
+            pin_cpus=args.pin_cpus,
+            use_fast_rollout=args.fast_rollout)
         supervisor.start()
         supervisor.join()
 